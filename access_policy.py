@@ -0,0 +1,246 @@
+import json
+import os
+import threading
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+
+# ==============================================================================
+# ACCESS POLICY - jadwal akses per user / grup, hari libur, masa berlaku kartu
+# ==============================================================================
+# Semua jadwal dikompilasi sekali menjadi daftar interval terurut dalam
+# "menit sejak Senin 00:00" (0..10080). Cek akses per tap = lookup dict UID
+# (O(1)) + bisect pada interval milik user tersebut (O(log n)). Keputusan
+# di-cache per UID sampai batas jadwal berikutnya, dan cache dibuang setiap
+# kali policy di-reload.
+#
+# Contoh konfigurasi:
+#   "ACCESS_GROUPS": {
+#       "cleaning": {"schedule": [{"days": "mon-fri", "start": "06:00", "end": "08:00"}]}
+#   },
+#   "ACCESS_POLICIES": {
+#       "1122334455": {"groups": ["cleaning"]},
+#       "5566778899": {"valid_from": "2026-01-01", "valid_until": "2026-01-31"}
+#   },
+#   "HOLIDAYS": ["2026-12-25"]
+#
+# User di VALID_USERS tanpa entri di ACCESS_POLICIES tetap boleh masuk kapan
+# saja. Hari libur hanya berlaku untuk user yang punya jadwal.
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+DAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+FULL_DAY_NAMES = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+def _parse_days(spec):
+    """Ubah "mon-fri" / "sat,sun" / ["sat", "sun"] menjadi daftar index hari."""
+    if isinstance(spec, str):
+        spec = [part.strip() for part in spec.split(",")]
+
+    days = []
+    for part in spec:
+        part = part.strip().lower()
+        if "-" in part:
+            first, last = (_day_index(d) for d in part.split("-", 1))
+            days.extend(i % 7 for i in range(first, first + (last - first) % 7 + 1))
+        else:
+            days.append(_day_index(part))
+    return sorted(set(days))
+
+
+def _day_index(name):
+    """Index hari dari nama ("mon" / "monday"), ValueError jika tidak dikenal."""
+    name = name.strip().lower()
+    for index, full_name in enumerate(FULL_DAY_NAMES):
+        if name in (DAY_NAMES[index], full_name):
+            return index
+    raise ValueError(f"nama hari tidak dikenal: '{name}' (pakai {', '.join(DAY_NAMES)})")
+
+
+def _parse_minutes(hhmm):
+    """Ubah "HH:MM" menjadi menit sejak 00:00 ("24:00" diperbolehkan)."""
+    try:
+        hours, minutes = (int(part) for part in hhmm.split(":"))
+    except (ValueError, AttributeError):
+        raise ValueError(f"format jam tidak valid: '{hhmm}' (harus HH:MM)")
+    if not (0 <= hours <= 24 and 0 <= minutes <= 59) or (hours == 24 and minutes > 0):
+        raise ValueError(f"jam di luar rentang 00:00-24:00: '{hhmm}'")
+    return hours * 60 + minutes
+
+
+def _parse_datetime(value, end_of_day=False):
+    """Parse tanggal / datetime ISO. Tanggal saja untuk valid_until = s/d akhir hari."""
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        # Jam sistem naif (waktu lokal): ubah ke waktu lokal tanpa zona
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    if len(value) == 10 and end_of_day:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def _compile_schedule(entries):
+    """Kompilasi entri jadwal menjadi interval mingguan terurut dan tidak overlap."""
+    intervals = []
+    for entry in entries:
+        try:
+            start = _parse_minutes(entry.get("start", "00:00"))
+            end = _parse_minutes(entry.get("end", "24:00"))
+            days = _parse_days(entry.get("days", DAY_NAMES))
+            if start == MINUTES_PER_DAY:
+                raise ValueError("jam mulai tidak boleh 24:00")
+        except ValueError as e:
+            raise ValueError(f"jadwal {entry}: {e}")
+        if end <= start:
+            # Jadwal lewat tengah malam (mis. 22:00-02:00)
+            end += MINUTES_PER_DAY
+        for day in days:
+            offset = day * MINUTES_PER_DAY
+            lo, hi = offset + start, offset + end
+            if hi > MINUTES_PER_WEEK:
+                # Minggu malam yang berlanjut ke Senin pagi
+                intervals.append((0, hi - MINUTES_PER_WEEK))
+                hi = MINUTES_PER_WEEK
+            intervals.append((lo, hi))
+
+    merged = []
+    for lo, hi in sorted(intervals):
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+class _CompiledRule:
+    __slots__ = ("starts", "ends", "valid_from", "valid_until")
+
+    def __init__(self, intervals, valid_from, valid_until):
+        # intervals=None berarti tidak ada batasan jadwal
+        self.starts = [lo for lo, _ in intervals] if intervals is not None else None
+        self.ends = [hi for _, hi in intervals] if intervals is not None else None
+        self.valid_from = valid_from
+        self.valid_until = valid_until
+
+
+class AccessPolicy:
+    def __init__(self, config):
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._users = {}
+        self._rules = {}
+        self._holidays = frozenset()
+        self.reload(config)
+
+    def reload(self, config):
+        """Kompilasi ulang policy dari config (dan file policy jika ada)."""
+        policy_config = {
+            "ACCESS_GROUPS": config.get("ACCESS_GROUPS", {}),
+            "ACCESS_POLICIES": config.get("ACCESS_POLICIES", {}),
+            "HOLIDAYS": config.get("HOLIDAYS", [])
+        }
+
+        policy_file = config.get("ACCESS_POLICY_FILE")
+        if policy_file and os.path.exists(policy_file):
+            try:
+                with open(policy_file) as f:
+                    policy_config.update(json.load(f))
+            except ValueError as e:
+                raise ValueError(f"{policy_file}: JSON tidak valid: {e}")
+
+        groups = {}
+        for name, group in policy_config["ACCESS_GROUPS"].items():
+            try:
+                if not isinstance(group, dict):
+                    raise ValueError(f"harus berupa dict, bukan {type(group).__name__}")
+                groups[name] = group.get("schedule", [])
+                _compile_schedule(groups[name])
+            except (ValueError, TypeError, AttributeError) as e:
+                raise ValueError(f"ACCESS_GROUPS['{name}']: {e}")
+
+        rules = {}
+        for card_uid, policy in policy_config["ACCESS_POLICIES"].items():
+            try:
+                if not isinstance(policy, dict):
+                    raise ValueError(f"harus berupa dict, bukan {type(policy).__name__}")
+                entries = list(policy.get("schedule", []))
+                for group_name in policy.get("groups", []):
+                    if group_name not in groups:
+                        raise ValueError(f"grup tidak dikenal: '{group_name}'")
+                    entries.extend(groups[group_name])
+                has_schedule = "schedule" in policy or "groups" in policy
+                rules[card_uid] = _CompiledRule(
+                    _compile_schedule(entries) if has_schedule else None,
+                    _parse_datetime(policy.get("valid_from")),
+                    _parse_datetime(policy.get("valid_until"), end_of_day=True)
+                )
+            except (ValueError, TypeError, AttributeError) as e:
+                raise ValueError(f"ACCESS_POLICIES['{card_uid}']: {e}")
+
+        try:
+            holidays = frozenset(date.fromisoformat(d) for d in policy_config["HOLIDAYS"])
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"HOLIDAYS: {e}")
+
+        # Swap sekaligus agar thread RFID tidak melihat policy setengah jadi
+        with self._lock:
+            self._users = dict(config["VALID_USERS"])
+            self._rules = rules
+            self._holidays = holidays
+            self._cache = {}
+
+    def check(self, card_uid, now=None):
+        """Cek akses kartu. Return (allowed, user_name, reason)."""
+        now = now or datetime.now()
+
+        with self._lock:
+            cached = self._cache.get(card_uid)
+            if cached and now < cached[0] and now >= cached[1]:
+                return cached[2]
+
+            decision, expires_at = self._evaluate(card_uid, now)
+            if expires_at is not None:
+                self._cache[card_uid] = (expires_at, now, decision)
+            return decision
+
+    def _evaluate(self, card_uid, now):
+        """Evaluasi policy dan hitung kapan keputusan ini kedaluwarsa (None = jangan di-cache)."""
+        user_name = self._users.get(card_uid)
+        never = datetime.max
+        if not user_name:
+            # Tidak di-cache: cukup satu lookup dict, dan UID acak tidak boleh menumpuk di cache
+            return (False, None, "tidak terdaftar"), None
+
+        rule = self._rules.get(card_uid)
+        if rule is None:
+            return (True, user_name, "ok"), never
+
+        if rule.valid_from and now < rule.valid_from:
+            return (False, user_name, "belum berlaku"), rule.valid_from
+        if rule.valid_until and now >= rule.valid_until:
+            return (False, user_name, "kartu kedaluwarsa"), never
+
+        expires_at = rule.valid_until or never
+        if rule.starts is None:
+            return (True, user_name, "ok"), expires_at
+
+        # Hari libur & pergantian hari: keputusan paling lama berlaku s/d tengah malam
+        next_midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        expires_at = min(expires_at, next_midnight)
+        if now.date() in self._holidays:
+            return (False, user_name, "hari libur"), expires_at
+
+        week_minute = now.weekday() * MINUTES_PER_DAY + now.hour * 60 + now.minute
+        index = bisect_right(rule.starts, week_minute) - 1
+        minute_start = now.replace(second=0, microsecond=0)
+
+        if index >= 0 and week_minute < rule.ends[index]:
+            boundary = minute_start + timedelta(minutes=rule.ends[index] - week_minute)
+            return (True, user_name, "ok"), min(expires_at, boundary)
+
+        if index + 1 < len(rule.starts):
+            boundary = minute_start + timedelta(minutes=rule.starts[index + 1] - week_minute)
+            expires_at = min(expires_at, boundary)
+        return (False, user_name, "di luar jadwal"), expires_at
@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+from collections import namedtuple
+from enum import Enum
+
+# ==============================================================================
+# DOOR STATE MACHINE - transisi berbasis tabel, event bertipe, log yang bisa di-replay
+# ==============================================================================
+# Mesin ini murni: tidak menyentuh hardware, tidak membaca jam. Input hanya
+# Event, output hanya daftar Action yang dieksekusi oleh SmartDoorLockSystem.
+# Karena itu log event (JSONL) cukup untuk mereproduksi insiden di lapangan.
+# Log dirotasi (door_events.jsonl.1, .2, ...). Baris pertama setiap file
+# hasil rotasi adalah snapshot state + timer aktif, sehingga replay tetap
+# benar walau file lama sudah terhapus. Replay dari file terlama:
+#
+#   python door_state_machine.py door_events.jsonl.2 door_events.jsonl.1 door_events.jsonl
+
+
+class State(Enum):
+    LOCKED = "LOCKED"                        # Terkunci, tidak ada yang menunggu
+    WAITING_FOR_RFID = "WAITING_FOR_RFID"    # Orang di pintu masuk, menunggu kartu
+    UNLOCKED = "UNLOCKED"                    # Pintu terbuka, menunggu auto-lock
+
+
+class EventType(Enum):
+    SYSTEM_START = "SYSTEM_START"            # Penanda start proses, reset ke LOCKED
+    PERSON_ARRIVED = "PERSON_ARRIVED"
+    PERSON_LEFT = "PERSON_LEFT"
+    RFID_GRANTED = "RFID_GRANTED"            # data: uid, user_name
+    RFID_DENIED = "RFID_DENIED"              # data: uid, reason
+    RFID_TIMEOUT = "RFID_TIMEOUT"
+    INSIDE_SENSOR = "INSIDE_SENSOR"
+    BLYNK_UNLOCK = "BLYNK_UNLOCK"
+    AUTO_LOCK_DUE = "AUTO_LOCK_DUE"
+    DOORWAY_CLEAR = "DOORWAY_CLEAR"
+    DOORWAY_BLOCKED = "DOORWAY_BLOCKED"      # data: distance
+
+
+class ActionType(Enum):
+    PLAY_AUDIO = "PLAY_AUDIO"                # args: key
+    UNLOCK = "UNLOCK"                        # args: method, user_name
+    LOCK = "LOCK"
+    START_TIMER = "START_TIMER"              # args: name
+    CANCEL_TIMER = "CANCEL_TIMER"            # args: name
+    CHECK_DOORWAY = "CHECK_DOORWAY"
+    RESET_ENTRANCE = "RESET_ENTRANCE"        # Deteksi ulang orang yang masih di pintu masuk
+
+
+Event = namedtuple("Event", ["type", "data"])
+Action = namedtuple("Action", ["type", "args"])
+
+# Nama timer → event yang dikirim saat timer habis
+TIMER_EVENTS = {
+    "rfid_timeout": EventType.RFID_TIMEOUT,
+    "auto_lock": EventType.AUTO_LOCK_DUE,
+}
+
+
+def make_event(event_type, **data):
+    return Event(event_type, data)
+
+
+def _action(action_type, **args):
+    return Action(action_type, args)
+
+
+# --- Handler transisi: event -> daftar action ---
+
+def _prompt_for_card(event):
+    return [
+        _action(ActionType.PLAY_AUDIO, key="welcome"),
+        _action(ActionType.START_TIMER, name="rfid_timeout"),
+    ]
+
+
+def _stop_waiting(event):
+    return [_action(ActionType.CANCEL_TIMER, name="rfid_timeout")]
+
+
+def _timeout_waiting(event):
+    # Orang yang masih berdiri di pintu harus dideteksi (dan diminta tap) lagi
+    return [
+        _action(ActionType.CANCEL_TIMER, name="rfid_timeout"),
+        _action(ActionType.RESET_ENTRANCE),
+    ]
+
+
+def _deny_card(event):
+    # Kartu ditolak: beri tahu, tetap menunggu kartu lain sampai timeout
+    return [
+        _action(ActionType.PLAY_AUDIO, key="denied"),
+        _action(ActionType.START_TIMER, name="rfid_timeout"),
+    ]
+
+
+def _unlock_rfid(event):
+    return [
+        _action(ActionType.CANCEL_TIMER, name="rfid_timeout"),
+        _action(ActionType.UNLOCK, method="RFID", user_name=event.data.get("user_name")),
+        _action(ActionType.START_TIMER, name="auto_lock"),
+    ]
+
+
+def _unlock_with(method):
+    def handler(event):
+        return [
+            _action(ActionType.CANCEL_TIMER, name="rfid_timeout"),
+            _action(ActionType.UNLOCK, method=method, user_name=None),
+            _action(ActionType.START_TIMER, name="auto_lock"),
+        ]
+    return handler
+
+
+def _check_doorway(event):
+    return [_action(ActionType.CHECK_DOORWAY)]
+
+
+def _lock(event):
+    return [_action(ActionType.LOCK)]
+
+
+def _retry_auto_lock(event):
+    return [_action(ActionType.START_TIMER, name="auto_lock")]
+
+
+# (state, event) -> (state berikutnya, handler). Kombinasi yang tidak ada di
+# tabel diabaikan tanpa mengubah state.
+TRANSITIONS = {
+    **{(state, EventType.SYSTEM_START): (State.LOCKED, _lock) for state in State},
+
+    (State.LOCKED, EventType.PERSON_ARRIVED): (State.WAITING_FOR_RFID, _prompt_for_card),
+    (State.LOCKED, EventType.INSIDE_SENSOR): (State.UNLOCKED, _unlock_with("INSIDE_SENSOR")),
+    (State.LOCKED, EventType.BLYNK_UNLOCK): (State.UNLOCKED, _unlock_with("BLYNK")),
+
+    (State.WAITING_FOR_RFID, EventType.RFID_GRANTED): (State.UNLOCKED, _unlock_rfid),
+    (State.WAITING_FOR_RFID, EventType.RFID_DENIED): (State.WAITING_FOR_RFID, _deny_card),
+    (State.WAITING_FOR_RFID, EventType.RFID_TIMEOUT): (State.LOCKED, _timeout_waiting),
+    (State.WAITING_FOR_RFID, EventType.PERSON_LEFT): (State.LOCKED, _stop_waiting),
+    (State.WAITING_FOR_RFID, EventType.INSIDE_SENSOR): (State.UNLOCKED, _unlock_with("INSIDE_SENSOR")),
+    (State.WAITING_FOR_RFID, EventType.BLYNK_UNLOCK): (State.UNLOCKED, _unlock_with("BLYNK")),
+
+    (State.UNLOCKED, EventType.AUTO_LOCK_DUE): (State.UNLOCKED, _check_doorway),
+    (State.UNLOCKED, EventType.DOORWAY_CLEAR): (State.LOCKED, _lock),
+    (State.UNLOCKED, EventType.DOORWAY_BLOCKED): (State.UNLOCKED, _retry_auto_lock),
+}
+
+
+class DoorStateMachine:
+    def __init__(self, initial_state=State.LOCKED):
+        self.state = initial_state
+
+    def handle(self, event):
+        """Proses satu event. Return (state lama, state baru, daftar action)."""
+        previous = self.state
+        transition = TRANSITIONS.get((previous, event.type))
+        if transition is None:
+            return previous, previous, []
+
+        self.state, handler = transition
+        return previous, self.state, handler(event)
+
+
+# ==============================================================================
+# EVENT LOG & REPLAY
+# ==============================================================================
+
+class EventLog:
+    def __init__(self, filepath, max_bytes=1024 * 1024, backup_count=3, snapshot=None):
+        self.filepath = filepath
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        # snapshot(): dict {"state": ..., "timers": {...}} saat ini, ditulis di awal file baru
+        self.snapshot = snapshot
+        self._file = open(filepath, "a") if filepath else None
+
+    def append(self, event):
+        """Tulis event ke log (satu baris JSON per event)."""
+        if not self._file:
+            return
+
+        # Rotasi sebelum menulis: snapshot = state setelah semua event di file lama
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self._rotate()
+            if self.snapshot:
+                self._write({"t": time.time(), "snapshot": self.snapshot()})
+
+        self._write({"t": time.time(), "event": event.type.value, "data": event.data})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def _rotate(self):
+        """Geser file log (.1 → .2, dst.) dan mulai file baru."""
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.filepath}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.filepath}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.filepath, f"{self.filepath}.1")
+        else:
+            os.remove(self.filepath)
+        self._file = open(self.filepath, "a")
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def read_event_log(filepath):
+    """Baca log event JSONL. Return (snapshot awal atau None, daftar (timestamp, Event))."""
+    snapshot = None
+    events = []
+    with open(filepath) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "snapshot" in record:
+                if not events and snapshot is None:
+                    snapshot = record["snapshot"]
+                continue
+            events.append((record["t"], Event(EventType(record["event"]), record["data"])))
+    return snapshot, events
+
+
+def replay(events, machine=None, snapshot=None):
+    """Jalankan ulang daftar event. Return daftar (timestamp, event, state lama, state baru, actions)."""
+    if machine is None:
+        machine = DoorStateMachine(State(snapshot["state"]) if snapshot else State.LOCKED)
+    trace = []
+    for timestamp, event in events:
+        previous, current, actions = machine.handle(event)
+        trace.append((timestamp, event, previous, current, actions))
+    return trace
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python door_state_machine.py <door_events.jsonl> [file lain, urut dari terlama]")
+        sys.exit(1)
+
+    snapshot, events = read_event_log(sys.argv[1])
+    for filepath in sys.argv[2:]:
+        events.extend(read_event_log(filepath)[1])
+
+    if snapshot:
+        print(f"Mulai dari snapshot: state={snapshot['state']} timers={snapshot.get('timers', {})}")
+    for timestamp, event, previous, current, actions in replay(events, snapshot=snapshot):
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+        names = ", ".join(
+            a.type.value + (f"({', '.join(f'{k}={v}' for k, v in a.args.items())})" if a.args else "")
+            for a in actions
+        )
+        print(f"{when}  {event.type.value:<16} {previous.value} → {current.value}  {names}")
@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+# ==============================================================================
+# SAMPLING PROFILER - dipakai oleh SmartDoorLockSystem untuk diagnosa di lapangan
+# ==============================================================================
+# Profiler ini tidak memasang hook apa pun (tidak memakai sys.setprofile /
+# sys.settrace). Saat tidak aktif tidak ada thread yang berjalan, sehingga
+# biayanya nol. Saat aktif, satu thread daemon mengambil snapshot stack semua
+# thread lewat sys._current_frames() setiap interval, lalu hasilnya ditulis
+# dalam format "collapsed stack" (satu baris per stack unik + jumlah sampel)
+# yang bisa langsung dipakai flamegraph.pl / speedscope / inferno.
+
+
+class SamplingProfiler:
+    def __init__(self, output_dir="profiles", interval_s=0.01, log=print):
+        self.output_dir = output_dir
+        self.interval_s = interval_s
+        self.log = log
+
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def is_running(self):
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def start(self, duration_s=30):
+        """Mulai sampling selama duration_s detik (no-op jika sudah berjalan)."""
+        with self._lock:
+            if self.is_running:
+                self.log("⚠️  Profiler sudah berjalan")
+                return False
+
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(
+                target=self._sampling_thread,
+                args=(duration_s, self._stop_event),
+                name="SamplingProfiler",
+                daemon=True
+            )
+            self._thread.start()
+
+        self.log(f"🔬 Profiler aktif selama {duration_s} detik (interval {self.interval_s * 1000:.0f}ms)")
+        return True
+
+    def stop(self):
+        """Hentikan sampling lebih awal; hasil tetap ditulis ke file."""
+        with self._lock:
+            if not self.is_running:
+                return False
+            self._stop_event.set()
+        return True
+
+    def toggle(self, duration_s=30):
+        """Start jika tidak aktif, stop jika sedang aktif."""
+        if self.is_running:
+            return self.stop()
+        return self.start(duration_s)
+
+    def _sampling_thread(self, duration_s, stop_event):
+        """Thread untuk mengambil sampel stack semua thread."""
+        own_ident = threading.get_ident()
+        stacks = Counter()
+        sample_count = 0
+        started_at = time.monotonic()
+        deadline = started_at + duration_s
+
+        while not stop_event.is_set() and time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stacks[self._collapse(names.get(ident, f"thread-{ident}"), frame)] += 1
+            sample_count += 1
+            stop_event.wait(self.interval_s)
+
+        elapsed = time.monotonic() - started_at
+        try:
+            filepath = self._write_collapsed(stacks)
+            self.log(f"🔬 Profiler selesai: {sample_count} sampel dalam {elapsed:.1f} detik → {filepath}")
+        except Exception as e:
+            self.log(f"❌ Profiler write error: {e}")
+
+    @staticmethod
+    def _collapse(thread_name, frame):
+        """Ubah frame menjadi satu baris collapsed stack (root;...;leaf)."""
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+            frame = frame.f_back
+        parts.append(thread_name.replace(";", ":").replace(" ", "_"))
+        parts.reverse()
+        return ";".join(parts)
+
+    def _write_collapsed(self, stacks):
+        """Tulis hasil sampling ke file .folded."""
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        filename = time.strftime("profile-%Y%m%d-%H%M%S.folded")
+        filepath = os.path.join(self.output_dir, filename)
+        with open(filepath, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return filepath
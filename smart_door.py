@@ -3,10 +3,17 @@ import os
 import threading
 import logging
 import json
+import queue
+import signal
 import paho.mqtt.publish as publish
 from gpiozero import OutputDevice, InputDevice, DistanceSensor
 import blynklib
-from gtts import gTTS
+from sampling_profiler import SamplingProfiler
+from access_policy import AccessPolicy
+from tts_cache import TTSCache
+from door_state_machine import (
+    DoorStateMachine, EventLog, State, EventType, ActionType, TIMER_EVENTS, make_event
+)
 
 # ==============================================================================
 # KONFIGURASI
@@ -21,13 +28,40 @@ CONFIG = {
         "1668106708": "Ajay",
         "0987654321": "Budi",
     },
+    "ACCESS_GROUPS": {},
+    "ACCESS_POLICIES": {},
+    "HOLIDAYS": [],
+    "ACCESS_POLICY_FILE": "access_policy.json",
     "DETECTION_DISTANCE_CM": 50,
     "UNLOCK_DURATION_S": 5,
     "DOORWAY_CLEAR_CM": 30,
+    "RFID_TIMEOUT_S": 10,
+    "DOOR_EVENT_LOG": "door_events.jsonl",
+    "DOOR_EVENT_LOG_MAX_KB": 1024,
+    "DOOR_EVENT_LOG_BACKUPS": 3,
     "TTS_LANGUAGE": 'id',
+    "TTS_VOICE_TLD": 'com',
+    "TTS_CACHE_DIR": 'tts_cache',
+    "TTS_CACHE_MAX_MB": 50,
+    "TTS_PRERENDER_WORKERS": 4,
     "MQTT_BROKER": "localhost",
-    "MQTT_TOPIC": "smartdoor/logs"
+    "MQTT_TOPIC": "smartdoor/logs",
+    "PROFILER_ENABLED": False,
+    "PROFILER_DURATION_S": 30,
+    "PROFILER_INTERVAL_MS": 10,
+    "PROFILER_OUTPUT_DIR": "profiles"
+}
+
+# Semua kalimat tetap, di-render ke cache saat start agar bisa diputar offline
+PROMPTS = {
+    "welcome": "Selamat datang, silahkan tap kartu Anda.",
+    "not_registered": "Kartu tidak terdaftar. Akses ditolak.",
+    "not_allowed": "Kartu tidak berlaku saat ini. Akses ditolak.",
+    "opened_inside": "Pintu dibuka dari dalam.",
+    "opened_blynk": "Pintu dibuka dari aplikasi.",
+    "doorway_blocked": "Pintu terhalang, penguncian ditunda.",
 }
+GREETING = "Selamat datang, {name}"
 
 # Logging Setup
 logging.basicConfig(
@@ -41,11 +75,21 @@ class SmartDoorLockSystem:
     def __init__(self, config):
         self.config = config
         self.is_locked = True
-        self.person_detected_at_entrance = False
-        self.waiting_for_rfid = False
-        self.rfid_user_request = None
-        self.blynk_unlock_request = False
-        self.inside_sensor_request = False
+        self.person_detected_at_entrance = False  # Hanya dipakai monitor pintu masuk (edge detection)
+
+        self.state_machine = DoorStateMachine()
+        self.events = queue.Queue()
+        self.event_log = EventLog(
+            self.config['DOOR_EVENT_LOG'],
+            max_bytes=self.config['DOOR_EVENT_LOG_MAX_KB'] * 1024,
+            backup_count=self.config['DOOR_EVENT_LOG_BACKUPS'],
+            snapshot=self._state_snapshot
+        )
+        self.timers = {}  # nama timer -> deadline (time.monotonic)
+        self.timer_durations = {
+            "rfid_timeout": self.config['RFID_TIMEOUT_S'],
+            "auto_lock": self.config['UNLOCK_DURATION_S']
+        }
 
         logging.info("Menginisialisasi Smart Door Lock System...")
 
@@ -56,15 +100,47 @@ class SmartDoorLockSystem:
             trigger=self.config["ULTRASONIC_TRIG_PIN"]
         )
 
-        if not os.path.exists('tts_cache'):
-            os.makedirs('tts_cache')
+        self.tts_cache = TTSCache(
+            cache_dir=self.config['TTS_CACHE_DIR'],
+            language=self.config['TTS_LANGUAGE'],
+            tld=self.config['TTS_VOICE_TLD'],
+            max_bytes=self.config['TTS_CACHE_MAX_MB'] * 1024 * 1024
+        )
+        threading.Thread(
+            target=self.prerender_prompts,
+            args=(list(PROMPTS.values()) + [GREETING.format(name=n) for n in self.config["VALID_USERS"].values()],),
+            daemon=True
+        ).start()
 
         self.blynk = blynklib.Blynk(self.config['BLYNK_AUTH_TOKEN'])
         self.setup_blynk_handlers()
 
+        self.profiler = SamplingProfiler(
+            output_dir=self.config['PROFILER_OUTPUT_DIR'],
+            interval_s=self.config['PROFILER_INTERVAL_MS'] / 1000.0,
+            log=logging.info
+        )
+        try:
+            signal.signal(signal.SIGUSR1, self._profiler_signal_handler)
+        except (AttributeError, ValueError) as e:
+            logging.warning(f"Profiler signal tidak tersedia: {e}")
+        if self.config['PROFILER_ENABLED']:
+            self.toggle_profiler()
+
+        try:
+            self.access_policy = AccessPolicy(self.config)
+        except Exception as e:
+            logging.error(f"Error jadwal akses, jadwal diabaikan (semua VALID_USERS boleh masuk): {e}")
+            self.access_policy = AccessPolicy({"VALID_USERS": self.config["VALID_USERS"]})
+        try:
+            signal.signal(signal.SIGHUP, self._access_policy_signal_handler)
+        except (AttributeError, ValueError) as e:
+            logging.warning(f"Reload policy via signal tidak tersedia: {e}")
+
         threading.Thread(target=self.blynk.run, daemon=True).start()
         threading.Thread(target=self._rfid_reader_thread, daemon=True).start()
         threading.Thread(target=self._monitor_inside_sensor, daemon=True).start()
+        threading.Thread(target=self._monitor_entrance, daemon=True).start()
 
     def publish_log(self, message):
         try:
@@ -80,7 +156,7 @@ class SmartDoorLockSystem:
                     msg = "Sensor no-touch di dalam terdeteksi."
                     logging.info(msg)
                     self.publish_log(msg)
-                    self.inside_sensor_request = True
+                    self.post_event(EventType.INSIDE_SENSOR)
                     time.sleep(2)
                 time.sleep(0.1)
             except Exception as e:
@@ -94,16 +170,41 @@ class SmartDoorLockSystem:
                 msg = "Permintaan buka kunci dari aplikasi Blynk."
                 logging.info(msg)
                 self.publish_log(msg)
-                self.blynk_unlock_request = True
+                self.post_event(EventType.BLYNK_UNLOCK)
+
+        @self.blynk.handle_event('write V4')
+        def profiler_button_handler(pin, value):
+            if value[0] == '1':
+                logging.info("Toggle profiler dari aplikasi Blynk.")
+                self.toggle_profiler()
+
+    def _profiler_signal_handler(self, signum, frame):
+        # Jangan logging / ambil lock di konteks signal: serahkan ke thread lain
+        threading.Thread(target=self.toggle_profiler, daemon=True).start()
+
+    def toggle_profiler(self):
+        self.profiler.toggle(self.config['PROFILER_DURATION_S'])
+
+    def _access_policy_signal_handler(self, signum, frame):
+        # Baca file / logging tidak boleh di konteks signal: serahkan ke thread lain
+        threading.Thread(target=self.reload_access_policy, daemon=True).start()
+
+    def reload_access_policy(self):
+        try:
+            self.access_policy.reload(self.config)
+            logging.info("Jadwal akses RFID di-reload.")
+        except Exception as e:
+            logging.error(f"Error reload jadwal akses: {e}")
+
+    def prerender_prompts(self, texts):
+        rendered = self.tts_cache.prerender(texts, workers=self.config['TTS_PRERENDER_WORKERS'])
+        logging.info(f"TTS pre-render selesai: {rendered} file baru dari {len(texts)} kalimat.")
 
     def speak(self, text):
         try:
             logging.info(f"TTS: {text}")
-            filename = os.path.join('tts_cache', f'{hash(text)}.mp3')
-            if not os.path.exists(filename):
-                tts = gTTS(text=text, lang=self.config['TTS_LANGUAGE'], slow=False)
-                tts.save(filename)
-            os.system(f'mpg123 -q "{filename}/"')
+            filename = self.tts_cache.get(text)
+            os.system(f'mpg123 -q "{filename}"')
         except Exception as e:
             logging.error(f"Error TTS: {e}")
 
@@ -118,23 +219,29 @@ class SmartDoorLockSystem:
                 time.sleep(1)
 
     def _process_rfid_card(self, card_uid):
-        user_name = self.config["VALID_USERS"].get(card_uid)
-        if user_name and self.waiting_for_rfid:
+        allowed, user_name, reason = self.access_policy.check(card_uid)
+        waiting = self.state_machine.state == State.WAITING_FOR_RFID
+        if allowed and waiting:
             msg = f"RFID Valid: {card_uid} - {user_name}"
             logging.info(msg)
             self.publish_log(msg)
-            self.rfid_user_request = user_name
-            self.waiting_for_rfid = False
-        elif user_name:
+        elif allowed:
             msg = f"RFID Valid: {user_name}, tetapi sistem tidak sedang menunggu."
             logging.warning(msg)
             self.publish_log(msg)
+        elif user_name:
+            msg = f"RFID Ditolak: {card_uid} - {user_name} ({reason})."
+            logging.warning(msg)
+            self.publish_log(msg)
         else:
             msg = f"RFID Ditolak: {card_uid} tidak terdaftar."
             logging.warning(msg)
             self.publish_log(msg)
-            if self.waiting_for_rfid:
-                self.speak("Kartu tidak terdaftar. Akses ditolak.")
+
+        if allowed:
+            self.post_event(EventType.RFID_GRANTED, uid=card_uid, user_name=user_name)
+        else:
+            self.post_event(EventType.RFID_DENIED, uid=card_uid, reason=reason)
 
     def update_blynk_status(self):
         try:
@@ -154,11 +261,11 @@ class SmartDoorLockSystem:
         self.is_locked = False
         self.update_blynk_status()
         if method == "RFID" and user_name:
-            self.speak(f"Selamat datang, {user_name}")
+            self.speak(GREETING.format(name=user_name))
         elif method == "INSIDE_SENSOR":
-            self.speak("Pintu dibuka dari dalam.")
+            self.speak(PROMPTS["opened_inside"])
         elif method == "BLYNK":
-            self.speak("Pintu dibuka dari aplikasi.")
+            self.speak(PROMPTS["opened_blynk"])
 
     def lock_door(self):
         if self.is_locked: return
@@ -168,39 +275,40 @@ class SmartDoorLockSystem:
         self.solenoid_relay.off()
         self.is_locked = True
         self.update_blynk_status()
+        # Orang yang masih berdiri di pintu masuk akan dideteksi ulang
         self.person_detected_at_entrance = False
-        self.waiting_for_rfid = False
 
-    def monitor_entrance(self):
-        try:
-            distance = self.entrance_ultrasonic.distance * 100
-            if distance < self.config['DETECTION_DISTANCE_CM'] and not self.person_detected_at_entrance and self.is_locked:
-                msg = f"Orang terdeteksi di pintu masuk (jarak: {distance:.1f}cm)"
-                logging.info(msg)
-                self.publish_log(msg)
-                self.person_detected_at_entrance = True
-                self.waiting_for_rfid = True
-                self.speak("Selamat datang, silahkan tap kartu Anda.")
-            elif distance > self.config['DETECTION_DISTANCE_CM'] + 10:
-                if self.person_detected_at_entrance and self.is_locked:
-                    msg = "Orang menjauh dari pintu masuk."
+    def _monitor_entrance(self):
+        while True:
+            try:
+                distance = self.entrance_ultrasonic.distance * 100
+                if distance < self.config['DETECTION_DISTANCE_CM'] and not self.person_detected_at_entrance and self.is_locked:
+                    msg = f"Orang terdeteksi di pintu masuk (jarak: {distance:.1f}cm)"
                     logging.info(msg)
                     self.publish_log(msg)
-                    self.person_detected_at_entrance = False
-                    self.waiting_for_rfid = False
-        except Exception as e:
-            logging.error(f"Error monitoring entrance: {e}")
+                    self.person_detected_at_entrance = True
+                    self.post_event(EventType.PERSON_ARRIVED, distance=round(distance, 1))
+                elif distance > self.config['DETECTION_DISTANCE_CM'] + 10:
+                    if self.person_detected_at_entrance and self.is_locked:
+                        msg = "Orang menjauh dari pintu masuk."
+                        logging.info(msg)
+                        self.publish_log(msg)
+                        self.person_detected_at_entrance = False
+                        self.post_event(EventType.PERSON_LEFT, distance=round(distance, 1))
+                time.sleep(0.1)
+            except Exception as e:
+                logging.error(f"Error monitoring entrance: {e}")
+                time.sleep(1)
 
     def check_door_clear_for_locking(self):
         try:
             distance = self.entrance_ultrasonic.distance * 100
-            while distance < self.config['DOORWAY_CLEAR_CM']:
+            if distance < self.config['DOORWAY_CLEAR_CM']:
                 msg = f"Halangan terdeteksi: {distance:.1f}cm. Menunggu..."
                 logging.warning(msg)
                 self.publish_log(msg)
-                self.speak("Pintu terhalang, penguncian ditunda.")
-                time.sleep(2)
-                distance = self.entrance_ultrasonic.distance * 100
+                self.speak(PROMPTS["doorway_blocked"])
+                return False
             msg = f"Area pintu bersih: {distance:.1f}cm"
             logging.info(msg)
             self.publish_log(msg)
@@ -209,34 +317,76 @@ class SmartDoorLockSystem:
             logging.error(f"Error checking door clearance: {e}")
             return True
 
+    def post_event(self, event_type, **data):
+        self.events.put(make_event(event_type, **data))
+
+    def _state_snapshot(self):
+        now = time.monotonic()
+        return {
+            "state": self.state_machine.state.value,
+            "timers": {name: round(deadline - now, 3) for name, deadline in self.timers.items()}
+        }
+
+    def _dispatch(self, event):
+        self.event_log.append(event)
+        previous, current, actions = self.state_machine.handle(event)
+        if previous != current:
+            logging.info(f"State: {previous.value} -> {current.value} ({event.type.value})")
+        for action in actions:
+            self._execute_action(action, event)
+
+    def _execute_action(self, action, event):
+        if action.type == ActionType.PLAY_AUDIO:
+            if action.args["key"] == "welcome":
+                self.speak(PROMPTS["welcome"])
+            elif event.data.get("reason") == "tidak terdaftar":
+                self.speak(PROMPTS["not_registered"])
+            else:
+                self.speak(PROMPTS["not_allowed"])
+        elif action.type == ActionType.UNLOCK:
+            self.unlock_door(action.args["method"], user_name=action.args["user_name"])
+        elif action.type == ActionType.LOCK:
+            self.lock_door()
+        elif action.type == ActionType.RESET_ENTRANCE:
+            self.person_detected_at_entrance = False
+        elif action.type == ActionType.START_TIMER:
+            duration = self.timer_durations[action.args["name"]]
+            if action.args["name"] == "auto_lock":
+                logging.info(f"Auto-lock dalam {duration} detik...")
+            self.timers[action.args["name"]] = time.monotonic() + duration
+        elif action.type == ActionType.CANCEL_TIMER:
+            self.timers.pop(action.args["name"], None)
+        elif action.type == ActionType.CHECK_DOORWAY:
+            logging.info("Memeriksa area pintu sebelum mengunci...")
+            if self.check_door_clear_for_locking():
+                self.post_event(EventType.DOORWAY_CLEAR)
+            else:
+                self.post_event(EventType.DOORWAY_BLOCKED)
+
+    def _fire_due_timers(self):
+        now = time.monotonic()
+        for name, deadline in list(self.timers.items()):
+            if deadline <= now:
+                del self.timers[name]
+                self.post_event(TIMER_EVENTS[name])
+
     def run(self):
-        self.lock_door()
+        self._dispatch(make_event(EventType.SYSTEM_START))
         logging.info("SMART DOOR LOCK SYSTEM V3 - AKTIF")
         try:
             while True:
-                self.monitor_entrance()
-                if self.rfid_user_request and self.is_locked:
-                    self.unlock_door("RFID", user_name=self.rfid_user_request)
-                    self.rfid_user_request = None
-                elif self.inside_sensor_request and self.is_locked:
-                    self.unlock_door("INSIDE_SENSOR")
-                    self.inside_sensor_request = False
-                elif self.blynk_unlock_request and self.is_locked:
-                    self.unlock_door("BLYNK")
-                    self.blynk_unlock_request = False
-
-                if not self.is_locked:
-                    logging.info(f"Auto-lock dalam {self.config['UNLOCK_DURATION_S']} detik...")
-                    time.sleep(self.config['UNLOCK_DURATION_S'])
-                    logging.info("Memeriksa area pintu sebelum mengunci...")
-                    if self.check_door_clear_for_locking():
-                        self.lock_door()
-
-                time.sleep(0.1)
+                # Tidur sampai ada event atau timer berikutnya jatuh tempo (maks. 1 detik)
+                wake_at = min([time.monotonic() + 1.0] + list(self.timers.values()))
+                try:
+                    self._dispatch(self.events.get(timeout=max(0, wake_at - time.monotonic())))
+                except queue.Empty:
+                    pass
+                self._fire_due_timers()
         except KeyboardInterrupt:
             logging.info("Sistem dihentikan oleh user.")
         finally:
             self.lock_door()
+            self.event_log.close()
             logging.info("Smart Door Lock System dimatikan.")
 
 if __name__ == '__main__':
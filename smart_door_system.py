@@ -1,10 +1,17 @@
 import time
 import os
+import queue
+import signal
 import threading
 import serial
 from gpiozero import OutputDevice, InputDevice, DistanceSensor
 import blynklib
 import pygame
+from sampling_profiler import SamplingProfiler
+from access_policy import AccessPolicy
+from door_state_machine import (
+    DoorStateMachine, EventLog, State, EventType, ActionType, TIMER_EVENTS, make_event
+)
 
 # ==============================================================================
 # KONFIGURASI - SILAKAN UBAH BAGIAN INI SESUAI KEBUTUHAN ANDA
@@ -34,17 +41,44 @@ CONFIG = {
         "2727983226": "Bilal"
     },
 
+    # --- Jadwal Akses RFID ---
+    # User tanpa entri di ACCESS_POLICIES boleh masuk kapan saja.
+    # Reload policy tanpa restart: kill -HUP <pid>
+    "ACCESS_GROUPS": {
+        "cleaning": {
+            "schedule": [{"days": "mon-fri", "start": "06:00", "end": "08:00"}]
+        }
+    },
+    "ACCESS_POLICIES": {
+        # "1122334455": {"groups": ["cleaning"]},
+        # "5566778899": {"valid_from": "2026-01-01", "valid_until": "2026-01-31"}
+    },
+    "HOLIDAYS": [],                          # Format: "YYYY-MM-DD"
+    "ACCESS_POLICY_FILE": "access_policy.json",  # Opsional, menimpa 3 key di atas
+
     # --- Pengaturan Sistem ---
     "DETECTION_DISTANCE_CM": 50,  # Jarak deteksi orang di pintu masuk
     "UNLOCK_DURATION_S": 5,       # Durasi pintu terbuka (detik)
     "DOORWAY_CLEAR_CM": 30,       # Jarak minimum untuk penguncian otomatis
+    "RFID_TIMEOUT_S": 10,         # Timeout menunggu kartu RFID (detik)
+    "DOOR_EVENT_LOG": "door_events.jsonl",  # Log event untuk replay insiden
+    "DOOR_EVENT_LOG_MAX_KB": 1024,          # Rotasi log setelah ukuran ini
+    "DOOR_EVENT_LOG_BACKUPS": 3,            # Jumlah file log lama yang disimpan
     
     # --- File Audio ---
     "AUDIO_FILES": {
         "welcome": "silahkan.mp3",
         "enter": "masuk.mp3", 
-        "denied": "maaf.mp3"
-    }
+        "denied": "maaf.mp3",               # Kartu belum terdaftar
+        "not_allowed": "tidak_berlaku.mp3"  # Kartu terdaftar, tapi di luar jadwal / kedaluwarsa
+    },
+
+    # --- Profiler (diagnosa performa di lapangan) ---
+    # Toggle via: kill -USR1 <pid> | Blynk V4 | PROFILER_ENABLED=True saat start
+    "PROFILER_ENABLED": False,     # Langsung profiling saat sistem start
+    "PROFILER_DURATION_S": 30,     # Lama sampling (detik)
+    "PROFILER_INTERVAL_MS": 10,    # Jarak antar sampel stack
+    "PROFILER_OUTPUT_DIR": "profiles"
 }
 # ==============================================================================
 
@@ -54,15 +88,22 @@ class SmartDoorLockSystem:
         
         # Status sistem
         self.is_locked = True
-        self.person_detected_at_entrance = False
-        self.waiting_for_rfid = False
-        self.rfid_timeout = 10  # timeout untuk menunggu RFID (detik)
+        self.person_detected_at_entrance = False  # Hanya dipakai entrance monitor (edge detection)
         
-        # Flags untuk permintaan unlock
-        self.rfid_unlock_approved = False
-        self.rfid_user_name = None
-        self.inside_sensor_unlock = False
-        self.blynk_unlock_request = False
+        # State machine pintu: thread sensor mengirim event, main loop memprosesnya
+        self.state_machine = DoorStateMachine()
+        self.events = queue.Queue()
+        self.event_log = EventLog(
+            self.config.get("DOOR_EVENT_LOG"),
+            max_bytes=self.config.get("DOOR_EVENT_LOG_MAX_KB", 1024) * 1024,
+            backup_count=self.config.get("DOOR_EVENT_LOG_BACKUPS", 3),
+            snapshot=self._state_snapshot
+        )
+        self.timers = {}  # nama timer -> deadline (time.monotonic)
+        self.timer_durations = {
+            "rfid_timeout": self.config.get("RFID_TIMEOUT_S", 10),
+            "auto_lock": self.config["UNLOCK_DURATION_S"]
+        }
         
         # Thread control
         self.running = True
@@ -79,6 +120,12 @@ class SmartDoorLockSystem:
         # Inisialisasi Blynk
         self._init_blynk()
         
+        # Inisialisasi Profiler
+        self._init_profiler()
+        
+        # Inisialisasi Access Policy
+        self._init_access_policy()
+        
         # Start background threads
         self._start_threads()
         
@@ -156,14 +203,73 @@ class SmartDoorLockSystem:
         except Exception as e:
             print(f"❌ Error inisialisasi Blynk: {e}")
 
+    def _init_profiler(self):
+        """Inisialisasi sampling profiler (tanpa biaya saat tidak aktif)."""
+        self.profiler = SamplingProfiler(
+            output_dir=self.config.get("PROFILER_OUTPUT_DIR", "profiles"),
+            interval_s=self.config.get("PROFILER_INTERVAL_MS", 10) / 1000.0
+        )
+        
+        try:
+            signal.signal(signal.SIGUSR1, self._profiler_signal_handler)
+            print(f"🔬 Profiler siap (kill -USR1 {os.getpid()} untuk toggle)")
+        except (AttributeError, ValueError) as e:
+            # SIGUSR1 tidak ada di Windows / bukan main thread
+            print(f"⚠️  Profiler signal tidak tersedia: {e}")
+        
+        if self.config.get("PROFILER_ENABLED"):
+            self.toggle_profiler()
+
+    def _init_access_policy(self):
+        """Kompilasi jadwal akses RFID."""
+        try:
+            self.access_policy = AccessPolicy(self.config)
+            print("📅 Jadwal akses RFID dimuat")
+        except Exception as e:
+            print(f"❌ Error jadwal akses: {e}")
+            print("📝 Jadwal diabaikan, semua VALID_USERS boleh masuk kapan saja")
+            self.access_policy = AccessPolicy({"VALID_USERS": self.config["VALID_USERS"]})
+        
+        try:
+            signal.signal(signal.SIGHUP, self._access_policy_signal_handler)
+        except (AttributeError, ValueError) as e:
+            print(f"⚠️  Reload policy via signal tidak tersedia: {e}")
+
+    def _access_policy_signal_handler(self, signum, frame):
+        """Handler SIGHUP untuk reload jadwal akses."""
+        # Baca file / print tidak boleh di konteks signal: serahkan ke thread lain
+        threading.Thread(target=self.reload_access_policy, daemon=True).start()
+
+    def reload_access_policy(self):
+        """Reload jadwal akses dan buang cache keputusan."""
+        try:
+            self.access_policy.reload(self.config)
+            print("📅 Jadwal akses RFID di-reload")
+        except Exception as e:
+            print(f"❌ Error reload jadwal akses: {e}")
+
+    def _profiler_signal_handler(self, signum, frame):
+        """Handler SIGUSR1 untuk toggle profiler."""
+        # Jangan print / ambil lock di konteks signal: serahkan ke thread lain
+        threading.Thread(target=self.toggle_profiler, daemon=True).start()
+
+    def toggle_profiler(self):
+        """Start/stop sampling profiler."""
+        self.profiler.toggle(self.config.get("PROFILER_DURATION_S", 30))
+
     def _setup_blynk_handlers(self):
         """Setup Blynk event handlers."""
         @self.blynk.handle_event('write V1')
         def unlock_button_handler(pin, value):
             if value[0] == '1':
                 print("📱 Permintaan unlock dari Blynk app")
-                with self.lock:
-                    self.blynk_unlock_request = True
+                self.post_event(EventType.BLYNK_UNLOCK)
+
+        @self.blynk.handle_event('write V4')
+        def profiler_button_handler(pin, value):
+            if value[0] == '1':
+                print("📱 Toggle profiler dari Blynk app")
+                self.toggle_profiler()
 
     def _start_threads(self):
         """Start semua background threads."""
@@ -193,7 +299,7 @@ class SmartDoorLockSystem:
         print("🔍 RFID reader thread started")
         while self.running:
             try:
-                if self.waiting_for_rfid:
+                if self.state_machine.state == State.WAITING_FOR_RFID:
                     print("⏳ Menunggu kartu RFID...")
                     card_uid = self._read_rfid_card()
                     if card_uid:
@@ -227,18 +333,14 @@ class SmartDoorLockSystem:
 
     def _process_rfid_card(self, card_uid):
         """Proses kartu RFID yang dibaca."""
-        user_name = self.config["VALID_USERS"].get(card_uid)
+        allowed, user_name, reason = self.access_policy.check(card_uid)
         
-        with self.lock:
-            if user_name:
-                print(f"✅ RFID Valid: {card_uid} - {user_name}")
-                self.rfid_unlock_approved = True
-                self.rfid_user_name = user_name
-            else:
-                print(f"❌ RFID Ditolak: {card_uid} tidak terdaftar")
-                self.rfid_unlock_approved = False
-                
-            self.waiting_for_rfid = False
+        if allowed:
+            print(f"✅ RFID Valid: {card_uid} - {user_name}")
+            self.post_event(EventType.RFID_GRANTED, uid=card_uid, user_name=user_name)
+        else:
+            print(f"❌ RFID Ditolak: {card_uid} {reason}")
+            self.post_event(EventType.RFID_DENIED, uid=card_uid, reason=reason)
 
     def _inside_sensor_thread(self):
         """Thread untuk monitor sensor di dalam."""
@@ -251,8 +353,7 @@ class SmartDoorLockSystem:
                 # Sensor no-touch (active low - False berarti terdeteksi)
                 if not sensor_state and self.is_locked:
                     print("👆 Sensor no-touch di dalam terdeteksi")
-                    with self.lock:
-                        self.inside_sensor_unlock = True
+                    self.post_event(EventType.INSIDE_SENSOR)
                     time.sleep(2)  # Debounce
                     
                 time.sleep(0.5)  # Slower polling untuk debug
@@ -264,7 +365,6 @@ class SmartDoorLockSystem:
     def _entrance_monitor_thread(self):
         """Thread untuk monitor pintu masuk."""
         print("🔍 Entrance monitor thread started")
-        rfid_start_time = None
         
         while self.running:
             try:
@@ -280,32 +380,15 @@ class SmartDoorLockSystem:
                     self.is_locked):
                     
                     print(f"👤 Orang terdeteksi di pintu masuk (jarak: {distance:.1f}cm)")
-                    
-                    with self.lock:
-                        self.person_detected_at_entrance = True
-                        self.waiting_for_rfid = True
-                        
-                    rfid_start_time = time.time()
-                    self.play_audio("welcome")  # "Silahkan tap kartu anda"
-                
-                # Timeout RFID
-                elif (self.waiting_for_rfid and rfid_start_time and 
-                      time.time() - rfid_start_time > self.rfid_timeout):
-                    
-                    print("⏰ RFID timeout - reset detection")
-                    with self.lock:
-                        self.waiting_for_rfid = False
-                        self.person_detected_at_entrance = False
-                    rfid_start_time = None
+                    self.person_detected_at_entrance = True
+                    self.post_event(EventType.PERSON_ARRIVED, distance=round(distance, 1))
                 
                 # Reset detection jika orang menjauh
                 elif distance > self.config['DETECTION_DISTANCE_CM'] + 10:
                     if self.person_detected_at_entrance and self.is_locked:
                         print("🚶 Orang menjauh dari pintu masuk")
-                        with self.lock:
-                            self.person_detected_at_entrance = False
-                            self.waiting_for_rfid = False
-                        rfid_start_time = None
+                        self.person_detected_at_entrance = False
+                        self.post_event(EventType.PERSON_LEFT, distance=round(distance, 1))
                 
                 time.sleep(1.0)  # Slower polling untuk debug
                 
@@ -365,11 +448,8 @@ class SmartDoorLockSystem:
             self.solenoid_relay.off()  # Matikan relay (kunci pintu)
             self.is_locked = True
             
-            # Reset flags
+            # Orang yang masih berdiri di pintu masuk akan dideteksi ulang
             self.person_detected_at_entrance = False
-            self.waiting_for_rfid = False
-            self.rfid_unlock_approved = False
-            self.rfid_user_name = None
         
         # Update status ke Blynk
         self._update_blynk_status()
@@ -402,10 +482,72 @@ class SmartDoorLockSystem:
             print(f"❌ Door clearance check error: {e}")
             return True
 
+    def post_event(self, event_type, **data):
+        """Kirim event ke main loop (aman dipanggil dari thread mana pun)."""
+        self.events.put(make_event(event_type, **data))
+
+    def _state_snapshot(self):
+        """State machine + sisa waktu timer, untuk baris pertama log hasil rotasi."""
+        now = time.monotonic()
+        return {
+            "state": self.state_machine.state.value,
+            "timers": {name: round(deadline - now, 3) for name, deadline in self.timers.items()}
+        }
+
+    def _dispatch(self, event):
+        """Catat event, jalankan transisi, lalu eksekusi action-nya."""
+        self.event_log.append(event)
+        previous, current, actions = self.state_machine.handle(event)
+        
+        if previous != current:
+            print(f"🔁 {previous.value} → {current.value} ({event.type.value})")
+        
+        for action in actions:
+            self._execute_action(action, event)
+
+    def _execute_action(self, action, event):
+        """Eksekusi satu action dari state machine."""
+        if action.type == ActionType.PLAY_AUDIO:
+            audio_key = action.args["key"]
+            if audio_key == "denied":
+                print(f"❌ Akses ditolak ({event.data.get('reason')})")
+                if event.data.get("reason") != "tidak terdaftar":
+                    audio_key = "not_allowed"
+            self.play_audio(audio_key)
+        elif action.type == ActionType.UNLOCK:
+            self.unlock_door(action.args["method"], user_name=action.args["user_name"])
+        elif action.type == ActionType.LOCK:
+            self.lock_door()
+        elif action.type == ActionType.RESET_ENTRANCE:
+            self.person_detected_at_entrance = False
+        elif action.type == ActionType.START_TIMER:
+            duration = self.timer_durations[action.args["name"]]
+            if action.args["name"] == "auto_lock":
+                print(f"⏳ Auto-lock dalam {duration} detik...")
+            self.timers[action.args["name"]] = time.monotonic() + duration
+        elif action.type == ActionType.CANCEL_TIMER:
+            self.timers.pop(action.args["name"], None)
+        elif action.type == ActionType.CHECK_DOORWAY:
+            if self._check_door_clear_for_locking():
+                self.post_event(EventType.DOORWAY_CLEAR)
+            else:
+                print("⏳ Menunggu area pintu bersih...")
+                self.post_event(EventType.DOORWAY_BLOCKED)
+
+    def _fire_due_timers(self):
+        """Kirim event untuk timer yang sudah habis."""
+        now = time.monotonic()
+        for name, deadline in list(self.timers.items()):
+            if deadline <= now:
+                del self.timers[name]
+                if name == "rfid_timeout":
+                    print("⏰ RFID timeout - reset detection")
+                self.post_event(TIMER_EVENTS[name])
+
     def run(self):
         """Main application loop."""
         # Pastikan pintu terkunci saat start
-        self.lock_door()
+        self._dispatch(make_event(EventType.SYSTEM_START))
         
         print("\n" + "="*70)
         print("🔐 SMART DOOR LOCK SYSTEM - AKTIF")
@@ -415,53 +557,24 @@ class SmartDoorLockSystem:
         print("🔄 Main loop started - sistem sedang berjalan...")
 
         try:
-            loop_count = 0
+            heartbeat_count = 0
+            next_heartbeat = time.monotonic() + 10
             while self.running:
-                loop_count += 1
+                # Tidur sampai ada event atau timer/heartbeat berikutnya jatuh tempo
+                wake_at = min([next_heartbeat] + list(self.timers.values()))
+                try:
+                    event = self.events.get(timeout=max(0, wake_at - time.monotonic()))
+                    self._dispatch(event)
+                except queue.Empty:
+                    pass
                 
-                # Debug output setiap 10 detik
-                if loop_count % 100 == 0:  # setiap 10 detik (0.1s * 100)
-                    print(f"💓 Heartbeat #{loop_count//100} - System running normally")
+                self._fire_due_timers()
                 
-                # Proses permintaan unlock
-                with self.lock:
-                    # RFID unlock
-                    if self.rfid_unlock_approved and self.is_locked:
-                        self.unlock_door("RFID", user_name=self.rfid_user_name)
-                        self.rfid_unlock_approved = False
-                        self.rfid_user_name = None
-                        
-                    # RFID ditolak
-                    elif (not self.rfid_unlock_approved and 
-                          not self.waiting_for_rfid and 
-                          self.person_detected_at_entrance):
-                        
-                        print("❌ Akses ditolak")
-                        self.play_audio("denied")  # "Maaf kartu belum terdaftar"
-                        self.person_detected_at_entrance = False
-                    
-                    # Inside sensor unlock
-                    elif self.inside_sensor_unlock and self.is_locked:
-                        self.unlock_door("INSIDE_SENSOR")
-                        self.inside_sensor_unlock = False
-                    
-                    # Blynk unlock
-                    elif self.blynk_unlock_request and self.is_locked:
-                        self.unlock_door("BLYNK")
-                        self.blynk_unlock_request = False
-
-                # Auto-lock setelah durasi tertentu
-                if not self.is_locked:
-                    print(f"⏳ Auto-lock dalam {self.config['UNLOCK_DURATION_S']} detik...")
-                    time.sleep(self.config['UNLOCK_DURATION_S'])
-                    
-                    # Cek area pintu sebelum mengunci
-                    if self._check_door_clear_for_locking():
-                        self.lock_door()
-                    else:
-                        print("⏳ Menunggu area pintu bersih...")
-
-                time.sleep(0.1)
+                # Debug output setiap 10 detik
+                if time.monotonic() >= next_heartbeat:
+                    heartbeat_count += 1
+                    next_heartbeat += 10
+                    print(f"💓 Heartbeat #{heartbeat_count} - State: {self.state_machine.state.value}")
 
         except KeyboardInterrupt:
             print("\n⏹️  Sistem dihentikan oleh user")
@@ -472,6 +585,7 @@ class SmartDoorLockSystem:
         finally:
             self.running = False
             self.lock_door()
+            self.event_log.close()
             print("🔐 Smart Door Lock System dimatikan")
 
 # ==============================================================================
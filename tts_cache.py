@@ -0,0 +1,110 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from gtts import gTTS
+
+# ==============================================================================
+# TTS CACHE - cache mp3 gTTS berbasis konten, persisten antar restart
+# ==============================================================================
+# Nama file = sha256(bahasa, voice/tld, teks), jadi stabil antar proses
+# (berbeda dengan hash() bawaan Python yang diacak per proses). Ukuran folder
+# dibatasi; file yang paling lama tidak diputar dihapus lebih dulu (LRU,
+# urutan dipulihkan dari mtime saat start).
+
+
+class TTSCache:
+    def __init__(self, cache_dir="tts_cache", language="id", tld="com", max_bytes=50 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.language = language
+        self.tld = tld
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # path -> ukuran, paling lama dipakai di depan
+        self._total_bytes = 0
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._load_index()
+
+    def _load_index(self):
+        """Bangun ulang urutan LRU dari file yang sudah ada."""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".mp3") and os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, path, stat.st_size))
+
+        for _, path, size in sorted(files):
+            self._entries[path] = size
+            self._total_bytes += size
+
+    def path_for(self, text):
+        """Path cache untuk teks ini (belum tentu sudah ada)."""
+        key = "\0".join([self.language, self.tld, text])
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.mp3")
+
+    def get(self, text):
+        """Return path mp3 untuk teks, render via gTTS jika belum ada di cache."""
+        path = self.path_for(text)
+
+        with self._lock:
+            if path in self._entries and os.path.exists(path):
+                self._entries.move_to_end(path)
+                os.utime(path)
+                return path
+
+        self._render(text, path)
+        return path
+
+    def _render(self, text, path):
+        """Render teks ke mp3 (tulis ke file sementara lalu rename, agar atomik)."""
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            tts = gTTS(text=text, lang=self.language, tld=self.tld, slow=False)
+            tts.save(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            # Mis. offline: jangan tinggalkan file .tmp di luar batas ukuran cache
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._total_bytes -= self._entries.pop(path, 0)
+            self._entries[path] = os.path.getsize(path)
+            self._total_bytes += self._entries[path]
+            self._evict()
+
+    def _evict(self):
+        """Hapus file paling lama tidak dipakai sampai ukuran di bawah batas."""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            path, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def prerender(self, texts, workers=4):
+        """Render semua teks yang belum ada di cache secara paralel. Return jumlah yang dirender."""
+        missing = [text for text in dict.fromkeys(texts) if not os.path.exists(self.path_for(text))]
+        if not missing:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(self._render_safely, missing)
+        return sum(results)
+
+    def _render_safely(self, text):
+        try:
+            self._render(text, self.path_for(text))
+            return 1
+        except Exception as e:
+            logging.error(f"Error pre-render TTS '{text}': {e}")
+            return 0